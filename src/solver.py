@@ -1,26 +1,83 @@
 import os
+import asyncio
+import functools
 import numpy as np
 from tqdm import tqdm
-from pymatgen.core import Structure
-from pymatgen.io.vasp.outputs import Vasprun, Chgcar, Oszicar, Outcar, Potcar
 from siman.calc_manage import smart_structure_read
+from xml.etree import ElementTree
 
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from itertools import combinations
 from scipy.constants import physical_constants
+from scipy.linalg import lstsq, qr, qr_insert, solve_triangular
+from scipy.spatial import cKDTree
 from itertools import combinations
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import warnings
 warnings.filterwarnings("ignore")
 
 k_B = physical_constants['Boltzmann constant in eV/K'][0]
 
 
+def _poscar_natoms(path_to_poscar: str) -> int:
+    """
+    Number of atoms from the POSCAR header (6th line for VASP 4 format,
+    7th line if the 6th one contains element names).
+    """
+    with open(path_to_poscar) as poscar_f:
+        for _ in range(5):
+            poscar_f.readline()
+        counts_line = poscar_f.readline().split()
+        if not counts_line[0].isdigit():
+            counts_line = poscar_f.readline().split()
+    return sum(int(i) for i in counts_line if i.isdigit())
+
+
 def get_ratio(path_to_structure: str, initial_atoms_num: float) -> float:
-    tmp_strucuture = Structure.from_file(path_to_structure)
-    ratio = len(tmp_strucuture) / initial_atoms_num
+    ratio = _poscar_natoms(path_to_structure) / initial_atoms_num
     return ratio
 
 
+def _neighbours(path_to_poscar: str, n_neighbours: int = 500) -> tuple:
+    """
+    Elements and distances (rounded to 0.001 A) of the 500 nearest
+    neighbours of the first atom, periodic images included.
+    The cell is replicated by -m..m in every direction; m is increased until
+    the sphere with the farthest found neighbour fits into the replicated
+    block, so no periodic image closer than it can be missed.
+    """
+    st = smart_structure_read(path_to_poscar)
+
+    rprimd = np.asarray(st.rprimd, dtype=np.float64)
+    elements = np.asarray(st.get_elements())
+    # wrap all the atoms into the cell
+    xred = np.asarray(st.xcart, dtype=np.float64) @ np.linalg.inv(rprimd)
+    xcart = (xred - np.floor(xred)) @ rprimd
+    natoms = len(xcart)
+
+    # distances between the opposite faces of the cell
+    volume = abs(np.linalg.det(rprimd))
+    heights = volume / np.linalg.norm(np.cross(rprimd[[1, 2, 0]], rprimd[[2, 0, 1]]), axis=1)
+
+    m = max(2, int(np.ceil(((n_neighbours + 1) / natoms) ** (1 / 3) / 2)))
+    while True:
+        shifts = np.arange(-m, m + 1)
+        translations = np.stack(np.meshgrid(shifts, shifts, shifts, indexing='ij'),
+                                axis=-1).reshape(-1, 3) @ rprimd
+        images = (translations[:, None, :] + xcart[None, :, :]).reshape(-1, 3)
+        if len(images) > n_neighbours:
+            # first neighbour is the atom itself
+            dist, idx = cKDTree(images).query(xcart[0], k=n_neighbours + 1)
+            if dist[-1] <= (m - 1) * heights.min():
+                break
+        m += 1
+
+    el_arr = elements[idx[1:] % natoms]
+    dist_arr = np.round(dist[1:], 3)
+    return el_arr, dist_arr
+
+
 def count_nn(path_to_poscar: str, magnetic_atoms: list) -> dict:
     """
     calculated the number of nearest neighbors,
@@ -40,38 +97,153 @@ def count_nn(path_to_poscar: str, magnetic_atoms: list) -> dict:
     if not os.path.exists(path_to_poscar):
         print(f'File {path_to_poscar} does not exist!')
         return None
-    st = smart_structure_read(path_to_poscar)
-    st = st.replic([6, 6, 6])
-    out = st.nn(i=1, n=500, silent=1)
-
-    a = list(zip(out['el'][1:], out['dist'][1:]))
-    # collect all the unique distances
-    unique_dist = set(round(i[1], 3) for i in a if i[0] in magnetic_atoms)
-    magnetic_dist_lst = [(el, round(dist, 3)) for el, dist in a if el in magnetic_atoms]
-
-    dist_neighbNum = {_: 0 for _ in unique_dist}  # key- distane, value list of
-    # neighbours at 1st 2nd 3d coordination spheres
-
-    for dist in unique_dist:
-        for el, distance in magnetic_dist_lst:
-            if dist == distance:
-                if el == magnetic_atoms[0]:
-                    dist_neighbNum[dist] += 1
-                elif el == magnetic_atoms[1]:
-                    dist_neighbNum[dist] -= 1
+    mtime = os.path.getmtime(path_to_poscar)
+    return dict(_count_nn_cached(path_to_poscar, mtime, tuple(magnetic_atoms)))
+
+
+@functools.lru_cache(maxsize=256)
+def _count_nn_cached(path_to_poscar: str, mtime: float, magnetic_atoms: tuple) -> dict:
+    """
+    Cached part of count_nn(), the modification time is a part of the key
+    so the result is recalculated if the POSCAR file was rewritten.
+    """
+    el_arr, dist_arr = _neighbours(path_to_poscar)
+
+    # elements are encoded as integer species codes,
+    # sign_table: +1 for spin up, -1 for spin down, 0 for non-magnetic atoms
+    species, species_codes = np.unique(el_arr, return_inverse=True)
+    sign_table = np.zeros(len(species), dtype=int)
+    sign_table[species == magnetic_atoms[0]] = 1
+    sign_table[species == magnetic_atoms[1]] = -1
+    sign = sign_table[species_codes]
+    mask = sign != 0
+
+    # key- distance, value - number of neighbours
+    # at 1st 2nd 3d coordination spheres
+    unique_dist, inverse = np.unique(dist_arr[mask], return_inverse=True)
+    neighb_num = np.bincount(inverse, weights=sign[mask], minlength=len(unique_dist))
+    dist_neighbNum = dict(zip(unique_dist.tolist(), neighb_num.astype(int).tolist()))
     return dist_neighbNum
 
 
-def get_nn_list(path_to_poscar: str, magnetic_atom: str) -> list:
-    nn_list = list(count_nn(path_to_poscar, magnetic_atoms=[magnetic_atom, 'Po']).values())
+def count_nn_single_species(path_to_poscar: str, magnetic_atom: str) -> dict:
+    """
+    Number of magnetic neighbours at each distance for the structure with
+    only one magnetic species (e.g. initial FM POSCAR), no fake spin down atom
+    is needed in the POSCAR.
+
+    Returns:
+        dict{distance : number_of_neibours}
+    """
+    if not os.path.exists(path_to_poscar):
+        print(f'File {path_to_poscar} does not exist!')
+        return None
+    el_arr, dist_arr = _neighbours(path_to_poscar)
+    unique_dist, neighb_num = np.unique(dist_arr[el_arr == magnetic_atom], return_counts=True)
+    return dict(zip(unique_dist.tolist(), neighb_num.tolist()))
+
+
+def get_nn_list(path_to_poscar: str, magnetic_atom: str, spin_down_atom: str = 'Po') -> list:
+    """
+    Args:
+        spin_down_atom (str) - "fake" atom marking spin down magnetic atoms
+                               in siman POSCARs (see afm_atom_creator()).
+    """
+    nn_list = list(count_nn(path_to_poscar, magnetic_atoms=[magnetic_atom, spin_down_atom]).values())
     return nn_list
 
 
+def _fast_final_energy(path_to_vasprun: str) -> float:
+    """
+    Read only the energy of the last ionic step from vasprun.xml
+    without building the whole Vasprun object, every element is cleared
+    right after it is read.
+    Like Vasprun(...).final_energy the e_0_energy of the ionic step is
+    replaced by e_0 - e_fr of the last electronic step + e_fr of the
+    ionic step if they differ (vasprun.xml bug in some VASP versions,
+    https://www.vasp.at/forum/viewtopic.php?f=3&t=16942).
+    """
+    ionic_energy = {}
+    electronic_energy = {}
+    in_scstep = False
+    for event, elem in ElementTree.iterparse(path_to_vasprun, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'scstep':
+                in_scstep = True
+                electronic_energy = {}
+            continue
+        if elem.tag == 'scstep':
+            in_scstep = False
+        elif elem.tag == 'i' and elem.get('name') in ('e_0_energy', 'e_fr_energy'):
+            energy = electronic_energy if in_scstep else ionic_energy
+            energy[elem.get('name')] = float(elem.text)
+        elem.clear()
+
+    if 'e_0_energy' not in ionic_energy:
+        return None
+    final_energy = ionic_energy['e_0_energy']
+    if 'e_0_energy' in electronic_energy and 'e_fr_energy' in electronic_energy:
+        final_energy_bugfix = np.round(electronic_energy['e_0_energy'] -
+                                       electronic_energy['e_fr_energy'] +
+                                       ionic_energy['e_fr_energy'], 8)
+        if abs(final_energy - final_energy_bugfix) > 1e-7:
+            return final_energy_bugfix
+    return final_energy
+
+
+def _fast_converged(path_to_vasprun: str) -> bool:
+    """
+    Electronic and ionic convergence check from vasprun.xml,
+    the same criteria as Vasprun.converged_electronic and Vasprun.converged_ionic:
+    number of electronic steps of the last ionic step is less than NELM
+    and number of ionic steps is less than NSW (for NSW > 1).
+    Raises an exception if vasprun.xml is incomplete.
+    """
+    params = {'NELM': 60, 'NSW': 0}
+    ionic_steps = 0
+    electronic_steps = 0
+    for event, elem in ElementTree.iterparse(path_to_vasprun, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'calculation':
+                ionic_steps += 1
+                electronic_steps = 0
+            continue
+        if elem.tag == 'scstep':
+            electronic_steps += 1
+        elif elem.tag == 'i' and elem.get('name') in params:
+            params[elem.get('name')] = int(elem.text)
+        elem.clear()
+    converged_electronic = electronic_steps < params['NELM']
+    converged_ionic = params['NSW'] <= 1 or ionic_steps < params['NSW']
+    return converged_electronic and converged_ionic
+
+
+def get_spin(path_to_oszicar: str, tail_size: int = 200_000) -> float:
+    """
+    Total magnetic moment on the last ionic step ('mag=' in OSZICAR).
+    Only the tail of the file is read, so the whole OSZICAR is not parsed.
+
+    Returns:
+        float or None if there is no ionic step with the magnetic moment
+    """
+    with open(path_to_oszicar, 'rb') as osz_f:
+        osz_f.seek(0, os.SEEK_END)
+        size = osz_f.tell()
+        osz_f.seek(max(0, size - tail_size))
+        tail = osz_f.read().decode(errors='ignore')
+    idx = tail.rfind('mag=')
+    if idx == -1:
+        return None
+    return float(tail[idx + len('mag='):].split()[0])
+
+
 def is_good_structure(struct_folder: str) -> bool:
     """
 
     Check if structures after relaxation are sutable for
-    futher Heisenberg hamiltonian calculations
+    futher Heisenberg hamiltonian calculations.
+    Presence of vasprun.xml and OSZICAR is checked beforehand
+    by check_struct_files() in find_good_structures().
 
     Return:
         True/False
@@ -80,19 +252,14 @@ def is_good_structure(struct_folder: str) -> bool:
 
     vasprun_path = os.path.join(struct_folder, 'vasprun.xml')
     osz_path = os.path.join(struct_folder, 'OSZICAR')
-    assert os.path.exists(vasprun_path), 'File vasprun.xml absent! Cant continue :('
-    assert os.path.exists(osz_path), 'File OSZICAR absent! Cant continue :('
 
-    try:
-        vasprun = Vasprun(vasprun_path, parse_dos=False, parse_eigen=False)
-    except Exception:
+    # cheapest check first: magnetic moment from the tail of OSZICAR
+    mag_mom = get_spin(osz_path)
+    if mag_mom is None:
         return False
-
-    osz = Oszicar(osz_path)
-    mag_mom = abs(osz.ionic_steps[-1]['mag'])
+    mag_mom = abs(mag_mom)
 
     mag_crit = False
-    converg_crit = False
 
     if os.path.basename(struct_folder) == 'fm0' and mag_mom > 1.0:
         mag_crit = True
@@ -100,10 +267,56 @@ def is_good_structure(struct_folder: str) -> bool:
     if os.path.basename(struct_folder) != 'fm0' and mag_mom < 0.1:
         mag_crit = True
 
-    if vasprun.converged * vasprun.converged_electronic * vasprun.converged_ionic:
-        converg_crit = True
+    if not mag_crit:
+        return False
+
+    # vasprun.xml is parsed only for structures with a proper magnetic moment
+    try:
+        converg_crit = _fast_converged(vasprun_path)
+    except Exception:
+        return False
+
+    return bool(converg_crit)
+
+
+def _struct_files(struct_folder: str) -> list:
+    return [os.path.join(struct_folder, file_name) for file_name in ('vasprun.xml', 'OSZICAR')]
+
 
-    return bool(converg_crit * mag_crit)
+async def _check_struct_folder(struct_folder: str, semaphore: asyncio.Semaphore) -> dict:
+    paths = _struct_files(struct_folder)
+    async with semaphore:
+        exists = await asyncio.gather(*[asyncio.to_thread(os.path.exists, path) for path in paths])
+    return dict(zip(paths, exists))
+
+
+async def _check_struct_folders(struct_folders: list, max_concurrent: int = 32) -> list:
+    """
+    Check that all the VASP output files are present, the checks for
+    different folders are overlapped (useful on slow NFS/Lustre filesystems).
+    """
+    semaphore = asyncio.Semaphore(max_concurrent)
+    return await asyncio.gather(*[_check_struct_folder(struct_folder, semaphore)
+                                  for struct_folder in struct_folders])
+
+
+def check_struct_files(struct_folders: list) -> None:
+    """
+    Assert that vasprun.xml and OSZICAR exist in every structure folder.
+    Inside already running event loop (e.g. Jupyter) asyncio.run() can not be
+    used, so the files are checked one by one.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        files_exist_list = asyncio.run(_check_struct_folders(struct_folders))
+    else:
+        files_exist_list = [{path: os.path.exists(path) for path in _struct_files(struct_folder)}
+                            for struct_folder in struct_folders]
+
+    for files_exist in files_exist_list:
+        for path, exists in files_exist.items():
+            assert exists, f'File {path} absent! Cant continue :('
 
 
 def find_good_structures(input_path: str) -> list:
@@ -114,54 +327,73 @@ def find_good_structures(input_path: str) -> list:
 
     assert os.path.exists(vasp_inputs_path), f'Path "{vasp_inputs_path}" Does not exist!'
 
-    for magnetic_conf in os.listdir(vasp_inputs_path):
-        struct_folder = os.path.join(vasp_inputs_path, magnetic_conf)
-        if is_good_structure(struct_folder):
+    struct_folders = [os.path.join(vasp_inputs_path, magnetic_conf)
+                      for magnetic_conf in os.listdir(vasp_inputs_path)]
+    check_struct_files(struct_folders)
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        good_flags = list(executor.map(is_good_structure, struct_folders))
+
+    for struct_folder, is_good in zip(struct_folders, good_flags):
+        if is_good:
             good_struct_list.append(struct_folder)
         else:
             bad_struct_list.append(struct_folder)
     return good_struct_list, bad_struct_list
 
 
+def _parse_energy(struct_folder: str, initial_atoms_num: int) -> float:
+    vasprun_path = os.path.join(struct_folder, 'vasprun.xml')
+    poscar_path = os.path.join(struct_folder, 'POSCAR')
+    ratio = get_ratio(poscar_path, initial_atoms_num)
+    E_tot = _fast_final_energy(vasprun_path) / ratio
+    return E_tot
+
+
 def energy_list_getter(good_struct_list: list, initial_atoms_num: int) -> list:
-    E_list = []
-    for struct_folder in tqdm(good_struct_list):
-        vasprun_path = os.path.join(struct_folder, 'vasprun.xml')
-        poscar_path = os.path.join(struct_folder, 'POSCAR')
-        vasprun = Vasprun(vasprun_path, parse_dos=False, parse_eigen=False)
-        ratio = get_ratio(poscar_path, initial_atoms_num)
-        E_tot = vasprun.final_energy / ratio
-        E_list.append(E_tot)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        E_list = list(tqdm(executor.map(partial(_parse_energy, initial_atoms_num=initial_atoms_num),
+                                        good_struct_list),
+                           total=len(good_struct_list)))
     return np.array(E_list)
 
 
 def nn_matrix_getter(input_path: str, good_struct_list: list, magnetic_atom: str) -> list:
     good_structures_number = len(good_struct_list)
-    nn_matrix = []
-    for struct_folder in tqdm(good_struct_list):
+    nn_number = good_structures_number - 1
+    nn_matrix = np.empty((good_structures_number, nn_number + 1))
+    nn_matrix[:, 0] = 1.0
+    for idx, struct_folder in enumerate(tqdm(good_struct_list)):
         siman_path = os.path.join(input_path, 'siman_inputs',
                                   f'POSCAR_{struct_folder.split("/")[-1]}')
         nn_list = get_nn_list(path_to_poscar=siman_path, magnetic_atom=magnetic_atom)
-        nn_matrix.append(nn_list[:good_structures_number - 1])
-    nn_matrix = np.append(np.ones([len(nn_matrix), 1]), nn_matrix, 1)
-    return np.array(nn_matrix)
+        assert len(nn_list) >= nn_number, \
+            f'Only {len(nn_list)} coordination spheres found in {siman_path}, {nn_number} needed!'
+        nn_matrix[idx, 1:] = nn_list[:nn_number]
+    return nn_matrix
 
 
 def sorted_matrix_getter(input_path: str, magnetic_atom: str, spin: float) -> list:
     good_struct_list, bad_struct_list = find_good_structures(input_path)
-    initial_atoms_num = len(Structure.from_file(os.path.join(input_path, 'POSCAR')))
+    initial_atoms_num = _poscar_natoms(os.path.join(input_path, 'POSCAR'))
     E_list = energy_list_getter(good_struct_list, initial_atoms_num)
     nn_matrix = nn_matrix_getter(input_path, good_struct_list, magnetic_atom)
-    nn_spin_matrix = nn_matrix * spin * (spin + 1)
-    full_matrix = np.append(nn_spin_matrix, E_list.reshape(len(E_list), 1), axis=1)
-    sorted_matrix = full_matrix[np.argsort(full_matrix[:, -1])]
+    full_matrix = np.empty((nn_matrix.shape[0], nn_matrix.shape[1] + 1))
+    np.multiply(nn_matrix, spin * (spin + 1), out=full_matrix[:, :-1])
+    full_matrix[:, -1] = E_list
+    sorted_matrix = full_matrix[np.argsort(full_matrix[:, -1], kind='stable')]
     return nn_matrix, sorted_matrix, good_struct_list, bad_struct_list
 
 
-def exchange_coupling(matrix: list, energies: list) -> list:
-    determinant = np.linalg.det(matrix)
-    if determinant:
-        solution_vector = np.linalg.solve(matrix, energies)
+def exchange_coupling(Q: np.ndarray, R: np.ndarray, energies: list, tol: float = 1e-12) -> list:
+    """
+    Solve the system from its QR decomposition.
+    The matrix is treated as singular if any diagonal element of R
+    (the determinant up to a sign is their product) is close to zero.
+    """
+    R_diag = np.abs(np.diag(R))
+    if R_diag.min() > tol * max(R_diag.max(), 1.0):
+        solution_vector = solve_triangular(R, Q.T @ energies)
         return abs(solution_vector)
 
 
@@ -170,16 +402,21 @@ def j_vector_exact(sorted_matrix: list) -> list:
     Exact solution of the system in case of nonzero determinant.
     If mapped coefficients form a singular matrix, the least stable structure
     excluded from the calculations until the determinant becomes nonzero.
+    QR decomposition of the i by i system is obtained from the previous one
+    by inserting a new column and a new row.
     """
     energies = sorted_matrix[..., -1]
     matrix = sorted_matrix[..., :-1]
 
     matrix_size = matrix.shape[0]
     results = []
+    Q, R = qr(matrix[:2, :2])
     for i in range(2, matrix_size + 1):
-        tmp_matrix = matrix[:i, :i]
+        if i > 2:
+            Q, R = qr_insert(Q, R, matrix[:i - 1, i - 1], i - 1, which='col')
+            Q, R = qr_insert(Q, R, matrix[i - 1, :i], i - 1, which='row')
         tmp_energies = energies[:i]
-        solution_vector = exchange_coupling(tmp_matrix, tmp_energies)
+        solution_vector = exchange_coupling(Q, R, tmp_energies)
         if solution_vector is not None:
             results.append(solution_vector)
 
@@ -194,15 +431,27 @@ def j_vector_lstsq(sorted_matrix: list) -> list:
     list squares method. Starting from the N by N system, step by step excluding
     one of the variables from the fitting, till the N by 2 system with only
     2 variables (Eg, J_1).
+    QR decomposition is done only once: for the first i columns of the matrix
+    Q[:, :i] R[:i, :i] is their own QR decomposition, so each least squares
+    solution is a back substitution R[:i, :i] x = (Q^T E)[:i].
+    Rank deficient subsystems fall back to the rank-revealing QR ('gelsy'),
+    which also gives the minimum norm solution.
     """
     num_of_variables = sorted_matrix.shape[0]
     energies = sorted_matrix[..., -1]
     matrix = sorted_matrix[..., :-1]
 
+    Q, R = np.linalg.qr(matrix, mode='reduced')
+    y = Q.T @ energies
+    R_diag = np.abs(np.diag(R))
+    tol = np.finfo(np.float64).eps * max(matrix.shape) * R_diag.max()
+
     results = []
     for i in range(2, num_of_variables + 1):
-        tmp_matrix = matrix[..., :i]
-        x_lstsq = np.linalg.lstsq(tmp_matrix, energies)[0]
+        if R_diag[:i].min() > tol:
+            x_lstsq = solve_triangular(R[:i, :i], y[:i])
+        else:
+            x_lstsq = lstsq(matrix[..., :i], energies, lapack_driver='gelsy')[0]
         results.append(x_lstsq)
     E_geom_list = np.array([i[0] for i in results])
     j_vectors_list = [abs(i[1:]) for i in results]
@@ -210,83 +459,89 @@ def j_vector_lstsq(sorted_matrix: list) -> list:
 
 
 def Tc_list_getter(j_vector_list: list, z_vector: list) -> list:
-    T_c_list = []
-    for j_vector in j_vector_list:
-        z_vector_tmp = z_vector[:len(j_vector)]
-        T_c = round(sum(j_vector * z_vector_tmp) / (3 * k_B), 1)
-        T_c_list.append(T_c)
-    T_c_list = np.array(T_c_list)
+    """
+    Critical temperature for every j_vector in the list, j_vectors are
+    zero-padded into one matrix so all of them are processed by single
+    matrix-vector product.
+    """
+    if not len(j_vector_list):
+        return np.array([])
+    width = max(len(j_vector) for j_vector in j_vector_list)
+    j_matrix = np.zeros((len(j_vector_list), width))
+    for k, j_vector in enumerate(j_vector_list):
+        j_matrix[k, :len(j_vector)] = j_vector
+    z_vector_tmp = np.asarray(z_vector[:width], dtype=np.float64)
+    T_c_list = np.round(j_matrix @ z_vector_tmp / (3 * k_B), 1)
     return T_c_list
 
 
 def write_output(input_path: str, j_exact_list: list, j_lstsq_list: list, good_struct_list, bad_struct_list, nn_matrix, Egeom_exact_list, Egeom_lstsq_list, Tc_exact, Tc_lstsq):
-    output_text = ''
-
-    j_exact_str = 'Exchange coupling vector by exact solution (J, meV): \n \n'
-    for i in j_exact_list:
-        j_exact_str += '\t' + str(len(i)) + ' : ' + str(np.round(i * 1000, 2)) + '\n'
+    def j_rows(j_list: list) -> str:
+        return ''.join(['\t' + str(len(i)) + ' : ' +
+                        np.array2string(np.round(i * 1000, 2), precision=2) + '\n'
+                        for i in j_list])
 
-    j_lstsq_str = 'Exchange coupling vector by least squares method (J, meV): \n \n'
-    for i in j_lstsq_list:
-        j_lstsq_str += '\t' + str(len(i)) + ' : ' + str(np.round(i * 1000, 2)) + '\n'
+    j_exact_str = 'Exchange coupling vector by exact solution (J, meV): \n \n' + j_rows(j_exact_list)
+    j_lstsq_str = 'Exchange coupling vector by least squares method (J, meV): \n \n' + j_rows(j_lstsq_list)
 
     good_structures_str = 'good structures:\n\t' + \
         ' '.join([i.split('/')[-1] for i in sorted(good_struct_list)]) + '\n'
     bad_structures_str = 'bad structures: \n\t' + \
         ' '.join([i.split('/')[-1] for i in sorted(bad_struct_list)]) + '\n'
 
-    output_text += good_structures_str
-    output_text += '\n'
-    output_text += bad_structures_str
-    output_text += '\n'
-    output_text += 'nn_matrix:\n' + str(nn_matrix) + '\n'
-
-    output_text += '\n'
-    output_text += '-' * 79 + '\n'
-    output_text += 'Exact solution method: \n\n'
-    output_text += 'E_geom, eV:\n\n\t' + str(Egeom_exact_list) + '\n\n'
-    output_text += j_exact_str + '\n'
-    output_text += '\n' + 'Critical temperature (Tc, K):' + '\n\n\t' + str(Tc_exact) + '\n'
-
-    output_text += '\n'
-    output_text += '-' * 79 + '\n'
-    output_text += 'Least squares method: \n\n'
-    output_text += 'E_geom, eV:\n\n\t' + str(Egeom_lstsq_list) + '\n\n'
-    output_text += j_lstsq_str + '\n'
-    output_text += '\n' + 'Critical temperature (Tc, K):' + '\n\n\t' + str(Tc_lstsq) + '\n'
+    output_parts = [
+        good_structures_str, '\n',
+        bad_structures_str, '\n',
+        'nn_matrix:\n' + str(nn_matrix) + '\n',
+
+        '\n', '-' * 79 + '\n',
+        'Exact solution method: \n\n',
+        'E_geom, eV:\n\n\t' + str(Egeom_exact_list) + '\n\n',
+        j_exact_str + '\n',
+        '\n' + 'Critical temperature (Tc, K):' + '\n\n\t' + str(Tc_exact) + '\n',
+
+        '\n', '-' * 79 + '\n',
+        'Least squares method: \n\n',
+        'E_geom, eV:\n\n\t' + str(Egeom_lstsq_list) + '\n\n',
+        j_lstsq_str + '\n',
+        '\n' + 'Critical temperature (Tc, K):' + '\n\n\t' + str(Tc_lstsq) + '\n',
+    ]
+    output_text = ''.join(output_parts)
 
     out_path = os.path.join(input_path, 'OUTPUT.txt')
     with open(out_path, 'w') as out_f:
-        out_f.writelines(output_text)
+        out_f.write(output_text)
 
 
 def plot_j_values(input_path: str, j_vector_list: list, filename: str) -> None:
-    plt.figure(figsize=(7, 5), dpi=100)
+    fig = Figure(figsize=(7, 5), dpi=100)
+    ax = fig.subplots()
     j_vector_list_mev = [i * 1000 for i in j_vector_list]
     for y in j_vector_list_mev:
         x = range(1, len(y) + 1)
-        plt.plot(x, y)
-        plt.scatter(x, y, label=len(x))
-    plt.xlabel('Coordination sphere number', fontsize=14)
-    plt.ylabel('J, meV', fontsize=14)
-    plt.xticks(range(1, len(j_vector_list[-1]) + 1))
-    plt.grid(alpha=.4)
-    plt.legend()
+        ax.plot(x, y)
+        ax.scatter(x, y, label=len(x))
+    ax.set_xlabel('Coordination sphere number', fontsize=14)
+    ax.set_ylabel('J, meV', fontsize=14)
+    ax.set_xticks(range(1, len(j_vector_list[-1]) + 1))
+    ax.grid(alpha=.4)
+    ax.legend()
     abs_filename = os.path.join(input_path, f'{filename}.pdf')
-    plt.savefig(abs_filename, bbox_inches='tight')
+    fig.savefig(abs_filename, bbox_inches='tight')
 
 
 def plot_Tcs(input_path: str, Tc_lstsq: list, Tc_exact: list):
-    plt.figure(figsize=(8, 6), dpi=100)
-    plt.scatter(range(1, len(Tc_lstsq) + 1), Tc_lstsq, label='least squares', marker='v')
-    plt.scatter(range(1, len(Tc_exact) + 1), Tc_exact, label='exact solution')
-    plt.plot(range(1, len(Tc_lstsq) + 1), Tc_lstsq)
-    plt.plot(range(1, len(Tc_exact) + 1), Tc_exact)
-    plt.xlabel('Number of considered exchanges', fontsize=14)
-    plt.ylabel(r'$T_C, K$', fontsize=14)
-    plt.legend()
-    plt.grid(alpha=.4)
-    plt.savefig(os.path.join(input_path, 'Tcs_plot.pdf'), bbox_inches='tight')
+    fig = Figure(figsize=(8, 6), dpi=100)
+    ax = fig.subplots()
+    ax.scatter(range(1, len(Tc_lstsq) + 1), Tc_lstsq, label='least squares', marker='v')
+    ax.scatter(range(1, len(Tc_exact) + 1), Tc_exact, label='exact solution')
+    ax.plot(range(1, len(Tc_lstsq) + 1), Tc_lstsq)
+    ax.plot(range(1, len(Tc_exact) + 1), Tc_exact)
+    ax.set_xlabel('Number of considered exchanges', fontsize=14)
+    ax.set_ylabel(r'$T_C, K$', fontsize=14)
+    ax.legend()
+    ax.grid(alpha=.4)
+    fig.savefig(os.path.join(input_path, 'Tcs_plot.pdf'), bbox_inches='tight')
 
 
 def plot_E_tot(input_path: str, sorted_matrix: list, nn_matrix: list) -> None:
@@ -302,30 +557,32 @@ min  : {min_E_geom:.2f}   meV"""
     props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
 
     x = range(1, len(E_tot_norm) + 1)
-    plt.figure(figsize=(7, 5), dpi=100)
-    plt.scatter(x, E_tot_norm, color='r')
-    plt.plot(x, E_tot_norm, color='r')
-    plt.text(1, max(E_tot_norm), text, verticalalignment='top', bbox=props)
-    plt.grid(alpha=.4)
-    plt.xlabel('Spins (\u2191 - \u2193)', fontsize=12)
-    plt.ylabel(r'$E_{tot},  meV$', fontsize=12)
+    fig = Figure(figsize=(7, 5), dpi=100)
+    ax = fig.subplots()
+    ax.scatter(x, E_tot_norm, color='r')
+    ax.plot(x, E_tot_norm, color='r')
+    ax.text(1, max(E_tot_norm), text, verticalalignment='top', bbox=props)
+    ax.grid(alpha=.4)
+    ax.set_xlabel('Spins (\u2191 - \u2193)', fontsize=12)
+    ax.set_ylabel(r'$E_{tot},  meV$', fontsize=12)
     combination_list = [[int(p) for p in i[1:6]] for i in nn_matrix]
-    plt.xticks(x, combination_list, rotation=10, ha='right')
-    plt.savefig(os.path.join(input_path, 'E_tot_plot.pdf'), bbox_inches='tight')
+    ax.set_xticks(x)
+    ax.set_xticklabels(combination_list, rotation=10, ha='right')
+    fig.savefig(os.path.join(input_path, 'E_tot_plot.pdf'), bbox_inches='tight')
 
 
 def solver(input_path: str, magnetic_atom: str):
     spin_dict = {'Eu': 2.5, 'Fe': 2, 'Co': 1.5, 'Ni': 1, 'Cu': 0.5, 'Sm': 3, 'Nd': 1}
     spin = spin_dict[magnetic_atom]
+    z_vector = list(count_nn_single_species(os.path.join(input_path, 'POSCAR'),
+                                            magnetic_atom).values())
+
     nn_matrix, sorted_matrix, good_struct_list, bad_struct_list = sorted_matrix_getter(
         input_path, magnetic_atom, spin)
 
     Egeom_exact_list, j_exact_list = j_vector_exact(sorted_matrix)
     Egeom_lstsq_list, j_lstsq_list = j_vector_lstsq(sorted_matrix)
 
-    z_vector = get_nn_list(path_to_poscar=os.path.join(input_path, 'POSCAR'),
-                           magnetic_atom=magnetic_atom)
-
     Tc_exact = Tc_list_getter(j_exact_list, z_vector)
     Tc_lstsq = Tc_list_getter(j_lstsq_list, z_vector)
 